@@ -2,24 +2,41 @@
 """Download all of the scores from code-golf.io and create a spreadsheet showing how the proposed
 Bayesian scoring method will affect things."""
 
-import json
 import os
+import shutil
 import sqlite3
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from dataclasses import dataclass
+from itertools import groupby
 from math import ceil, floor, isclose
+from operator import itemgetter
 from time import time
-from typing import Dict, List
+from typing import Dict, List, NamedTuple
 
 import requests
 import xlsxwriter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from xlsxwriter.utility import xl_col_to_name
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 DIR = os.path.dirname(os.path.abspath(__file__))
+# Reuse one connection pool for all requests to code-golf.io, and retry transient failures.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(max_retries=Retry(
+    total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])))
+
+HOLE_HEADERS = ['User', 'Language', 'Chars', 'New Score', 'New Rank', 'Old Score', 'Old Rank',
+                'Δ Score', 'Δ Rank', 'To Rank Up', 'Lang. Sb', 'Lang. S', 'All S', 'Lang. N',
+                'Lang. M']
 
 
-@dataclass
-class LeaderboardEntry:
+class LeaderboardEntry(NamedTuple):
     """Represents a score as it appears on a leaderboard."""
     user: str
     lang: str
@@ -30,123 +47,221 @@ class LeaderboardEntry:
     submitted: str
 
 
-@dataclass
-class SolutionInfo:
-    """Represents a solution to a hole."""
-    user: str
-    lang: str
-    hole: str
-    strokes: int
-    submitted: str
-
-
 def get_file_path(name: str) -> str:
     """Get a local path for caching a json file."""
     return os.path.join(DIR, 'scores', f'{name}.json')
 
 def get_from_web() -> List[Dict]:
     """Get list of solutions from the web."""
-    text = requests.get('https://code-golf.io/scores/all-holes/all-langs/all').content.decode()
-    # Write the data to two files, one of which has the timestamp in its name.
+    content = SESSION.get('https://code-golf.io/scores/all-holes/all-langs/all', timeout=30).content
+    # Write the data to a file with the timestamp in its name, and link all.json to it. Both are
+    # written under temporary names first, so an interrupted run never leaves a partial file.
     timestamp = datetime.now().isoformat(timespec='seconds').replace(':', '-')
-    with open(get_file_path(timestamp), 'w', encoding='utf-8') as file:
-        file.write(text)
-    with open(get_file_path('all'), 'w', encoding='utf-8') as file:
-        file.write(text)
-    return json.loads(text)
+    path = get_file_path(timestamp)
+    with open(f'{path}.tmp', 'wb') as file:
+        file.write(content)
+    os.replace(f'{path}.tmp', path)
+    all_path = get_file_path('all')
+    try:
+        os.unlink(f'{all_path}.tmp')
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(path, f'{all_path}.tmp')
+    except OSError:
+        shutil.copyfile(path, f'{all_path}.tmp')
+    os.replace(f'{all_path}.tmp', all_path)
+    return json_loads(content)
 
 
 def get_from_file() -> List[Dict]:
     """Get list of solutions from a local file."""
-    with open(get_file_path('all'), 'r', encoding='utf-8') as file:
-        return json.load(file)
+    with open(get_file_path('all'), 'rb') as file:
+        return json_loads(file.read())
 
 
-def get_all_solutions(use_local_cache) -> List[SolutionInfo]:
-    """Get the user, language, character count, score, rank, and sort index for each solution."""
+def get_all_solutions(use_local_cache) -> List[Dict]:
+    """Get the login, hole, language, strokes, and submission time for each solution."""
     if use_local_cache:
-        scores = get_from_file()
-    else:
-        scores = get_from_web()
-
-    return [SolutionInfo(user=item['login'], hole=item['hole'], lang=item['lang'],
-                         strokes=int(item['strokes']), submitted=item['submitted'])
-            for item in scores]
+        return get_from_file()
+    return get_from_web()
 
 
-def make_database(cursor, all_solutions: List[SolutionInfo]):
+def make_database(cursor, all_solutions: List[Dict]):
     """Put all of the solutions into a database for easy querying."""
+    # Load the solutions in one transaction, then build everything derived from them in another.
+    # executescript commits the first transaction before running its script.
+    cursor.execute('BEGIN')
+    # Without a rowid, the rows are stored in the primary key's b-tree instead of in a table plus
+    # a separate index holding a second copy of the key columns.
     cursor.execute('''create table solutions
         (hole text, user text, lang text, strokes int, submitted text,
-         primary key (hole, user, lang))''')
-    cursor.execute('''create view m_values as
-        select
-            lang,
-            2.0 * NLang / Nmax + 1 as M
-          from (
-            select lang, count(*) as NLang from solutions group by lang
-          )
-          cross join (
-            select count(*) as Nmax from solutions group by lang order by count(*) desc limit 1
-          )''')
-    cursor.execute('''create view bayesian as
-        select
-            t1.lang,
-            t1.hole,
-            N,
-            M,
-            S,
-            Sa,
-            (N / (N + M)) * S + (M / (N + M)) * Sa as Sb
-          from (
-            select lang, hole, count(*) as N, min(strokes) as S
-            from solutions
-            group by lang, hole
-          ) as t1
-          inner join (
-            select hole, min(strokes) as Sa from solutions group by hole
-          ) as t2
-            on t1.hole = t2.hole
-          inner join m_values
-          on t1.lang = m_values.lang''')
-    cursor.execute('''create view scores as
-        select
-            user,
-            hole,
-            lang,
-            N,
-            M,
-            S,
-            Sa,
-            Sb,
-            strokes,
-            1000 * Sb / strokes as new_score,
-            submitted
-          from solutions
-          inner join bayesian using(lang, hole)''')
-    cursor.execute('''create view total_scores as
-        select
-            user,
-            sum(new_score) as total_score,
-            count(*) as holes,
-            sum(strokes) as strokes
-          from (
+         primary key (hole, user, lang)) without rowid''')
+    # Stream rows straight from the parsed JSON instead of building an intermediate list.
+    rows = ((item['hole'], item['login'], item['lang'], int(item['strokes']), item['submitted'])
+            for item in all_solutions)
+    cursor.executemany('INSERT INTO solutions (hole, user, lang, strokes, submitted) '
+                       'VALUES (?,?,?,?,?)', rows)
+    cursor.executescript('''
+        begin;
+        create index solutions_lang on solutions (lang);
+
+        -- The derived tables are computed once here instead of being re-evaluated as views for
+        -- every query.
+        create table m_values as
+            select
+                lang,
+                2.0 * count(*) / max(count(*)) over () + 1 as M
+              from solutions
+              group by lang;
+
+        create table bayesian as
+            select
+                t1.lang,
+                t1.hole,
+                N,
+                M,
+                S,
+                Sa,
+                (N / (N + M)) * S + (M / (N + M)) * Sa as Sb
+              from (
+                select lang, hole, count(*) as N, min(strokes) as S
+                from solutions
+                group by lang, hole
+              ) as t1
+              inner join (
+                select hole, min(strokes) as Sa from solutions group by hole
+              ) as t2
+                on t1.hole = t2.hole
+              inner join m_values
+              on t1.lang = m_values.lang;
+
+        create unique index bayesian_lang_hole on bayesian (lang, hole);
+
+        create table scores as
             select
                 user,
                 hole,
-                min(strokes) as strokes,
-                max(new_score) as new_score
-              from scores
-              group by user, hole
-          )
-          group by user''')
-    data = [(s.hole, s.user, s.lang, s.strokes, s.submitted) for s in all_solutions]
-    cursor.executemany('INSERT INTO solutions (hole, user, lang, strokes, submitted) '
-                       'VALUES (?,?,?,?,?)', data)
+                lang,
+                N,
+                M,
+                S,
+                Sa,
+                Sb,
+                strokes,
+                1000 * Sb / strokes as new_score,
+                submitted
+              from solutions
+              inner join bayesian using(lang, hole);
+
+        create table total_scores as
+            select
+                user,
+                sum(new_score) as total_score,
+                count(*) as holes,
+                sum(strokes) as strokes
+              from (
+                select
+                    user,
+                    hole,
+                    min(strokes) as strokes,
+                    max(new_score) as new_score
+                  from scores
+                  group by user, hole
+              )
+              group by user;
+
+        create index scores_hole on scores (hole);
+        create index scores_user_hole on scores (user, hole);
+        create index total_scores_user on total_scores (user);
+
+        -- The current scores for all languages are also computed once, rather than once per sheet.
+        create table old_hole_scores as
+            with scored_leaderboard as (
+              select hole,
+                     round(
+                         (count(*) over (partition by hole) -
+                            rank() over (partition by hole order by strokes) + 1)
+                         * (1000.0 / count(*) over (partition by hole))
+                     ) as points,
+                     strokes,
+                     submitted,
+                     user,
+                     lang
+                from solutions
+            ) select hole,
+                     user,
+                     lang,
+                     points,
+                     rank() over (partition by hole order by points desc, strokes) as rank,
+                     strokes,
+                     submitted
+                from scored_leaderboard;
+
+        create index old_hole_scores_hole on old_hole_scores (hole, user, lang);
+
+        -- sqlite doesn't support PostgreSQL's DISTINCT ON.
+        create table old_overall_scores as
+            with augmented_solutions as (
+              select hole,
+                     user,
+                     strokes,
+                     submitted,
+                     row_number() over (partition by hole, user
+                                        order by strokes, submitted) as hole_user_ordinal
+                from solutions
+            ), leaderboard as (
+              select hole,
+                     user,
+                     strokes,
+                     submitted
+                from augmented_solutions
+               where hole_user_ordinal = 1
+            ), scored_leaderboard as (
+              select hole,
+                     round(
+                         (count(*) over (partition by hole) -
+                            rank() over (partition by hole order by strokes) + 1)
+                         * (1000.0 / count(*) over (partition by hole))
+                     ) as points,
+                     strokes,
+                     submitted,
+                     user
+                from leaderboard
+            ), summed_leaderboard as (
+              select user,
+                     count(*)       as holes,
+                     sum(points)    as points,
+                     sum(strokes)   as strokes,
+                     max(submitted) as submitted
+                from scored_leaderboard
+            group by user
+            ) select user,
+                     points,
+                     rank() over (order by points desc, strokes) as rank,
+                     holes,
+                     strokes,
+                     submitted
+                from summed_leaderboard;
+
+        analyze;
+        commit;''')
 
 
 def get_overall_leaderboard(cursor, lang='all-langs') -> List[LeaderboardEntry]:
     """Get leaderboard entries for the overall leaderboard."""
+    if lang == 'all-langs':
+        query = '''
+            SELECT user,
+                   '' lang,
+                   points,
+                   rank,
+                   holes,
+                   strokes,
+                   submitted
+              FROM old_overall_scores
+          ORDER BY points DESC, strokes, submitted'''
+        return [LeaderboardEntry._make(item) for item in cursor.execute(query)]
     # sqlite doesn't support PostgreSQL's DISTINCT ON.
     query = '''
         WITH augmented_solutions AS (
@@ -157,7 +272,7 @@ def get_overall_leaderboard(cursor, lang='all-langs') -> List[LeaderboardEntry]:
                  ROW_NUMBER() OVER (PARTITION BY hole, user
                                     ORDER BY strokes, submitted) hole_user_ordinal
             FROM solutions
-           WHERE ? IN ('all-langs', lang)
+           WHERE lang = ?
         ), leaderboard AS (
           SELECT hole,
                  user,
@@ -193,13 +308,26 @@ def get_overall_leaderboard(cursor, lang='all-langs') -> List[LeaderboardEntry]:
                  submitted
             FROM summed_leaderboard
         ORDER BY points DESC, strokes, submitted'''
-    return [LeaderboardEntry(*item) for item in cursor.execute(query, [lang])]
+    return [LeaderboardEntry._make(item) for item in cursor.execute(query, [lang])]
 
 
 def get_leaderboard(cursor, hole='all-holes', lang='all-langs') -> List[LeaderboardEntry]:
     """Get leaderboard entries for a hole or for the overall leaderboard."""
     if hole == 'all-holes':
         return get_overall_leaderboard(cursor, lang)
+    if lang == 'all-langs':
+        query = '''
+            SELECT user,
+                   lang,
+                   points,
+                   rank,
+                   1 holes,
+                   strokes,
+                   submitted
+              FROM old_hole_scores
+             WHERE hole = ?
+          ORDER BY points DESC, strokes, submitted'''
+        return [LeaderboardEntry._make(item) for item in cursor.execute(query, [hole])]
     query = '''
         WITH leaderboard AS (
           SELECT hole,
@@ -209,7 +337,7 @@ def get_leaderboard(cursor, hole='all-holes', lang='all-langs') -> List[Leaderbo
                  lang
             FROM solutions
            WHERE hole = ?
-             AND ? IN ('all-langs', lang)
+             AND lang = ?
         ), scored_leaderboard AS (
           SELECT hole,
                  ROUND(
@@ -231,84 +359,68 @@ def get_leaderboard(cursor, hole='all-holes', lang='all-langs') -> List[Leaderbo
                  submitted
             FROM scored_leaderboard
         ORDER BY points DESC, strokes, submitted'''
-    return [LeaderboardEntry(*item) for item in cursor.execute(query, [hole, lang])]
+    return [LeaderboardEntry._make(item) for item in cursor.execute(query, [hole, lang])]
 
 
-def get_column_reference(headers, name):
-    """Make an Excel-style column reference."""
-    return chr(ord('A') + headers.index(name))
+def get_column_references(headers) -> Dict[str, str]:
+    """Make an Excel-style column reference for each header."""
+    return {name: xl_col_to_name(index) for index, name in enumerate(headers)}
 
 
-def get_column_range_reference(headers, name):
-    """Make an Excel-style column range reference for a single column."""
-    reference = get_column_reference(headers, name)
-    return f'{reference}:{reference}'
+def set_columns(worksheet, headers, widths, formats):
+    """Set the width and number format of each column that has one, so that rows can be written
+    with write_row."""
+    for index, name in enumerate(headers):
+        if name in widths or name in formats:
+            worksheet.set_column(index, index, widths.get(name), formats.get(name))
 
 
-def write_all_holes_worksheet(cursor, worksheet, formats): # pylint: disable=too-many-locals
+def write_all_holes_worksheet(cursor, worksheet, formats):
     """Write a worksheet for all-holes."""
     worksheet.freeze_panes(1, 0)
     headers = ['User', 'New Score', 'New Rank', 'Old Score', 'Old Rank', 'Δ Score', 'Δ Rank',
                'Strokes', 'Holes', 'Strokes/Hole']
-    # set column width
-    worksheet.set_column(get_column_range_reference(headers, 'User'), 22)
-    worksheet.set_column(get_column_range_reference(headers, 'Strokes/Hole'), 11)
-    for index, item in enumerate(headers):
-        worksheet.write(0, index, item)
-
-    results = list(cursor.execute('''
-        SELECT user,
-               total_score,
-               holes,
-               strokes,
-               RANK() OVER (ORDER BY total_score DESC) rank
-          FROM total_scores
-      ORDER BY total_score DESC'''))
-
-    old_results = {entry.user: entry for entry in get_leaderboard(cursor)}
+    set_columns(worksheet, headers, {'User': 22, 'Strokes/Hole': 11}, formats)
+    worksheet.write_row(0, 0, headers)
 
-    for index, item in enumerate(results):
-        user = item[0]
-        total_score = item[1]
-        holes = item[2]
-        strokes = item[3]
-        rank = item[4]
-        old_entry = old_results[user]
-        assert old_entry.user == user and old_entry.holes == holes and old_entry.strokes == strokes
-        data = [user, total_score, rank, old_entry.points, old_entry.rank, 0, 0, strokes, holes]
-        for column_index, column in enumerate(data):
-            worksheet.write(index + 1, column_index, column, formats.get(headers[column_index]))
-
-        def get_reference(name):
-            return get_column_reference(headers, name) + str(index + 2)
-        def set_column_value(name, value):
-            worksheet.write(index + 1, headers.index(name), value, formats[name])
-
-        set_column_value('Δ Score', f'={get_reference("New Score")}-{get_reference("Old Score")}')
-        set_column_value('Δ Rank', f'={get_reference("New Rank")}-{get_reference("Old Rank")}')
-        set_column_value('Strokes/Hole', f'={get_reference("Strokes")}/{get_reference("Holes")}')
+    # Nothing on this sheet depends on editable values, so the differences are computed here and
+    # written as numbers instead of formulas. The columns are selected in the order of the headers.
+    query = '''
+        WITH ranked_scores AS (
+          SELECT user,
+                 total_score,
+                 RANK() OVER (ORDER BY total_score DESC) rank,
+                 holes,
+                 strokes
+            FROM total_scores
+        ) SELECT user,
+                 total_score,
+                 ranked_scores.rank,
+                 old_overall_scores.points,
+                 old_overall_scores.rank,
+                 total_score - old_overall_scores.points,
+                 ranked_scores.rank - old_overall_scores.rank,
+                 ranked_scores.strokes,
+                 ranked_scores.holes,
+                 1.0 * ranked_scores.strokes / ranked_scores.holes
+            FROM ranked_scores
+       LEFT JOIN old_overall_scores USING (user)
+        ORDER BY total_score DESC'''
+    for index, item in enumerate(cursor.execute(query)):
+        worksheet.write_row(index + 1, 0, item)
 
 
 def floor_with_tolerance(num):
     """Acts like floor, but rounds up if num is close to the next highest integer."""
-    if isclose(num, ceil(num)):
-        return ceil(num)
+    ceiling = ceil(num)
+    if isclose(num, ceiling):
+        return ceiling
     return floor(num)
 
 
-def get_chars_to_rank_up(chars, new_rank, score_for_rank, n, m, sa, s, sb): # pylint: disable=invalid-name, too-many-arguments
-    """Determine the number of characters needed to achieve a given rank."""
-    target_score = None
-    target_rank = new_rank - 1
-    # There are gaps in rankings for ties. Find the next highest rank.
-    while True:
-        assert target_rank > 0
-        if target_rank in score_for_rank:
-            break
-        else:
-            target_rank -= 1
-
-    target_score = score_for_rank[target_rank]
+def get_chars_to_rank_up(chars, target_score, n, m, sa, s, sb): # pylint: disable=invalid-name, too-many-arguments
+    """Determine the number of characters needed to match or exceed the score at the next highest
+    rank."""
     assert chars > sa
     if chars == s:
         # This is the top score for the language. Improving it will affect Sb.
@@ -323,87 +435,73 @@ def get_chars_to_rank_up(chars, new_rank, score_for_rank, n, m, sa, s, sb): # py
     return to_rank_up
 
 
-def write_hole_worksheet(cursor, hole, worksheet, formats): # pylint: disable=too-many-locals
-    """Write a worksheet for a specific hole."""
-    query = '''
-        SELECT user,
-               lang,
-               N,
-               M,
-               S,
-               Sa,
-               Sb,
-               strokes,
-               new_score
-          FROM scores
-         WHERE hole = ?
-      ORDER BY new_score DESC, submitted'''
-    results = list(cursor.execute(query, [hole]))
-    old_results = {(entry.user, entry.lang): entry for entry in get_leaderboard(cursor, hole)}
-
-    headers = ['User', 'Language', 'Chars', 'New Score', 'New Rank', 'Old Score', 'Old Rank',
-               'Δ Score', 'Δ Rank', 'To Rank Up', 'Lang. Sb', 'Lang. S', 'All S', 'Lang. N',
-               'Lang. M']
-
-    worksheet.freeze_panes(1, 0)
-    # set column width
-    worksheet.set_column(get_column_range_reference(headers, 'User'), 22)
-    worksheet.set_column(get_column_range_reference(headers, 'To Rank Up'), 10)
-
-    for index, item in enumerate(headers):
-        worksheet.write(0, index, item)
-
+def get_hole_worksheet_rows(results) -> List[List]: # pylint: disable=too-many-locals
+    """Get the cell values for a hole worksheet, given the hole's rows from the scores table in
+    rank order. This doesn't touch the workbook, so it can run in a worker process."""
+    # The formulas only vary by row number, so they're built from templates. Only the columns that
+    # depend on Lang. Sb use formulas, so that editing values like M updates the scores.
+    cells = {name: f'{column}{{row}}'
+             for name, column in get_column_references(HOLE_HEADERS).items()}
+    new_score_template = f'=1000*{cells["Lang. Sb"]}/{cells["Chars"]}'
+    delta_score_template = f'={cells["New Score"]}-{cells["Old Score"]}'
+    N = cells['Lang. N']  # pylint: disable=invalid-name
+    M = cells['Lang. M']  # pylint: disable=invalid-name
+    S = cells['Lang. S']  # pylint: disable=invalid-name
+    Sa = cells['All S']   # pylint: disable=invalid-name
+    sb_template = f'=({N} / ({N} + {M})) * {S} + ({M} / ({N} + {M})) * {Sa}'
+
+    rows = []
     last_rank = None
-    score_for_rank = {}
+    last_score = None
+    # Rows are in rank order, so the score at the next highest rank is the score of the last row
+    # that had a different rank. There are gaps in rankings for ties.
+    target_score = None
 
     for index, item in enumerate(results):
-        user = item[0]
-        language = item[1]
+        user = item[1]
+        language = item[2]
         new_rank = index + 1
-        n = item[2]  # pylint: disable=invalid-name
-        m = item[3]  # pylint: disable=invalid-name
-        s = item[4]  # pylint: disable=invalid-name
-        sa = item[5] # pylint: disable=invalid-name
-        sb = item[6] # pylint: disable=invalid-name
-        chars = item[7]
-        new_score = item[8]
-        old_entry = old_results[user, language]
-
-        if last_rank and isclose(new_score, score_for_rank[last_rank]):
+        n = item[3]  # pylint: disable=invalid-name
+        m = item[4]  # pylint: disable=invalid-name
+        s = item[5]  # pylint: disable=invalid-name
+        sa = item[6] # pylint: disable=invalid-name
+        sb = item[7] # pylint: disable=invalid-name
+        chars = item[8]
+        new_score = item[9]
+        old_points = item[10]
+        old_rank = item[11]
+
+        if last_rank and isclose(new_score, last_score):
             new_rank = last_rank
+        elif last_rank:
+            target_score = last_score
 
         last_rank = new_rank
-        score_for_rank[new_rank] = new_score
+        last_score = new_score
 
         to_rank_up = None
         if new_rank > 1:
-            to_rank_up = get_chars_to_rank_up(
-                chars, new_rank, score_for_rank, n, m, sa, s, sb)
-
-        data = [user, language, chars, 0, new_rank, old_entry.points, old_entry.rank, 0, 0,
-                to_rank_up, sb, s, sa, n, m]
+            to_rank_up = get_chars_to_rank_up(chars, target_score, n, m, sa, s, sb)
 
-        for column_index, column in enumerate(data):
-            worksheet.write(index + 1, column_index, column, formats.get(headers[column_index]))
+        row = index + 2
+        rows.append([
+            user, language, chars, new_score_template.format(row=row), new_rank, old_points,
+            old_rank, delta_score_template.format(row=row), new_rank - old_rank, to_rank_up,
+            sb_template.format(row=row), s, sa, n, m])
+    return rows
 
-        def get_reference(name):
-            return get_column_reference(headers, name) + str(index + 2)
-        def set_column_value(name, value):
-            worksheet.write(index + 1, headers.index(name), value, formats[name])
 
-        set_column_value('New Score', f'=1000*{get_reference("Lang. Sb")}/{get_reference("Chars")}')
-        set_column_value('Δ Score', f'={get_reference("New Score")}-{get_reference("Old Score")}')
-        set_column_value('Δ Rank', f'={get_reference("New Rank")}-{get_reference("Old Rank")}')
+def write_hole_worksheet(rows, worksheet, formats):
+    """Write a worksheet for a specific hole."""
+    worksheet.freeze_panes(1, 0)
+    set_columns(worksheet, HOLE_HEADERS, {'User': 22, 'To Rank Up': 10}, formats)
 
-        N = get_reference('Lang. N')     # pylint: disable=invalid-name
-        M = get_reference('Lang. M')     # pylint: disable=invalid-name
-        S = get_reference('Lang. S') # pylint: disable=invalid-name
-        Sa = get_reference('All S')    # pylint: disable=invalid-name
-        sb_formula = f'=({N} / ({N} + {M})) * {S} + ({M} / ({N} + {M})) * {Sa}'
-        set_column_value('Lang. Sb', sb_formula)
+    worksheet.write_row(0, 0, HOLE_HEADERS)
+    for index, row in enumerate(rows):
+        worksheet.write_row(index + 1, 0, row)
 
 
-def make_spreadsheet(cursor, workbook, holes):
+def make_spreadsheet(cursor, workbook):
     """Write a spreadsheet showing how the Bayesian scoring method will affect things."""
     number_format1 = workbook.add_format({'num_format': '0.000'})
     number_format2 = workbook.add_format({'num_format': '0.00'})
@@ -418,9 +516,34 @@ def make_spreadsheet(cursor, workbook, holes):
 
     write_all_holes_worksheet(cursor, workbook.add_worksheet('all-holes'), formats)
 
-    for hole in sorted(holes):
-        worksheet = workbook.add_worksheet(hole[:31])
-        write_hole_worksheet(cursor, hole, worksheet, formats)
+    # Fetch the rows for every hole at once and split them up by hole.
+    query = '''
+        SELECT hole,
+               user,
+               lang,
+               N,
+               M,
+               S,
+               Sa,
+               Sb,
+               scores.strokes,
+               new_score,
+               old_hole_scores.points,
+               old_hole_scores.rank
+          FROM scores
+     LEFT JOIN old_hole_scores USING (hole, user, lang)
+      ORDER BY hole, new_score DESC, scores.submitted'''
+    holes = []
+    all_results = []
+    for hole, results in groupby(cursor.execute(query), key=itemgetter(0)):
+        holes.append(hole)
+        all_results.append(list(results))
+
+    # Computing the rows is CPU-bound and independent per hole, so it's done in worker processes.
+    # Only the main process writes to the workbook, in hole order.
+    with ProcessPoolExecutor() as executor:
+        for hole, rows in zip(holes, executor.map(get_hole_worksheet_rows, all_results)):
+            write_hole_worksheet(rows, workbook.add_worksheet(hole[:31]), formats)
 
 
 def _main():
@@ -442,25 +565,35 @@ def _main():
         print("Downloading new files. Please wait.")
     all_solutions = get_all_solutions(args.local)
     print(f'Loaded data in {time() - time1:.1f} seconds.')
-    holes = {solution.hole for solution in all_solutions}
-    user_count = len({solution.user for solution in all_solutions})
+    holes = set()
+    users = set()
+    for solution in all_solutions:
+        holes.add(solution['hole'])
+        users.add(solution['login'])
     print(f'Got {len(holes)} holes.')
-    print(f'Got {user_count} users.')
+    print(f'Got {len(users)} users.')
     print(f'Got {len(all_solutions)} solutions.')
     db_filename = os.path.join(DIR, 'scores.db')
     try:
         os.unlink(db_filename)
     except OSError:
         pass
-    connection = sqlite3.connect(db_filename)
+    # The database is recreated on every run, so build it in memory and only copy the finished
+    # database to disk at the end.
+    connection = sqlite3.connect(':memory:')
     cursor = connection.cursor()
+    cursor.execute('PRAGMA temp_store=MEMORY')
     make_database(cursor, all_solutions)
     filename = os.path.join(DIR, 'bayesian.xlsx')
-    workbook = xlsxwriter.Workbook(filename)
-    make_spreadsheet(cursor, workbook, holes)
+    # Rows are always written in order, so they can be streamed to disk as they're completed.
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+    make_spreadsheet(cursor, workbook)
     workbook.close()
     print(f'Wrote file: {filename}')
     connection.commit()
+    disk_connection = sqlite3.connect(db_filename)
+    connection.backup(disk_connection)
+    disk_connection.close()
     connection.close()
     print(f'Wrote file: {db_filename}')
 